@@ -1,14 +1,21 @@
 # app.py
-from flask import Flask, request, jsonify, render_template_string, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template_string, send_from_directory, stream_with_context
 from flask_cors import CORS
 from pydantic import BaseModel, ValidationError
+from typing import Optional
+import hmac
+import json
 import logging
 import os
 import uuid
 import tempfile
+import threading
+import time
 
 from config import Config
+from job_queue import JobQueue, QueueFullError, TERMINAL_STATUSES
 from services import assembly_ai, gemini, murf
+from services.key_pool import assembly_ai_keys, google_keys, murf_keys
 
 # --- App Initialization and Configuration ---
 app = Flask(__name__)
@@ -22,15 +29,26 @@ logger = logging.getLogger(__name__)
 # Note: This is not persistent and will reset on server restart.
 chat_history = {}
 
+# Responses waiting for the browser to fetch them over the streaming TTS route.
+# Entries expire after TTS_STREAM_TTL_SECONDS; relayed audio is cached so repeat and Range requests work.
+pending_streams = {}
+pending_streams_lock = threading.Lock()
+
 # Pydantic models for request and response validation
 class ChatRequest(BaseModel):
     voice_id: str = 'natalie'
+    audio_profile: Optional[str] = None
+    bandwidth_kbps: Optional[float] = None
+    audio_format: Optional[str] = None
+    sample_rate: Optional[int] = None
+    stream: bool = False
 
 class ChatResponse(BaseModel):
     success: bool
     transcription: str
     llm_response: str
     audio_url: str
+    audio_profile: str
 
 # --- Routes ---
 
@@ -310,77 +328,110 @@ def index():
             
             const formData = new FormData();
             formData.append('audio', recordedBlob, 'audio.wav');
+            formData.append('stream', 'true');
+            // Let the server pick an audio tier from the measured downlink (Mbps) when the browser reports it
+            if (navigator.connection && navigator.connection.downlink) {
+                formData.append('bandwidth_kbps', navigator.connection.downlink * 1000);
+            }
             
             try {
-                const response = await fetch(`/agent/chat/${sessionId}`, {
-                    method: 'POST',
-                    body: formData
-                });
-
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`);
-                }
-
-                const result = await response.json();
+                const result = await runChatJob(formData);
                 
                 if (result.error) {
                     showStatus(result.error, 'error');
-                    
-                    if (audioPlayer) {
-                        audioPlayer.pause();
-                        audioPlayer = null;
-                    }
-
-                    audioPlayer = new Audio('/fallback-audio');
-                    audioPlayer.play();
-                    isPlaying = true;
-                    
+                    playBotAudio('/fallback-audio');
                 } else {
                     appendMessage('user', result.transcription);
                     appendMessage('bot', result.llm_response);
-                    
-                    if (audioPlayer) {
-                        audioPlayer.pause();
-                        audioPlayer = null;
-                    }
-
-                    audioPlayer = new Audio(result.audio_url);
-                    audioPlayer.play();
-                    isPlaying = true;
-
+                    playBotAudio(result.audio_url);
                     showStatus('Audio processed successfully!', 'success');
                 }
 
-                audioPlayer.onended = () => {
-                    console.log('Bot response audio ended. Ready for new input.');
-                    isPlaying = false;
-                    const recordBtn = document.getElementById('recordBtn');
-                    recordBtn.disabled = false;
-                    recordBtn.textContent = 'Start';
-                    recordBtn.classList.remove('recording');
-                    showStatus('Click "Start" to record your next message.', 'info');
-                };
-
             } catch (error) {
                 showStatus('Error processing audio: ' + error.message, 'error');
-                if (audioPlayer) {
-                    audioPlayer.pause();
-                    audioPlayer = null;
-                }
-                audioPlayer = new Audio('/fallback-audio');
-                audioPlayer.play();
-                isPlaying = true;
-                audioPlayer.onended = () => {
-                    isPlaying = false;
-                    const recordBtn = document.getElementById('recordBtn');
-                    recordBtn.disabled = false;
-                    recordBtn.textContent = 'Start';
-                    recordBtn.classList.remove('recording');
-                    showStatus('Click "Start" to record your next message.', 'info');
-                };
+                playBotAudio('/fallback-audio');
             }
         }
+
+        function playBotAudio(url) {
+            if (audioPlayer) {
+                audioPlayer.pause();
+                audioPlayer = null;
+            }
+
+            const player = new Audio(url);
+            audioPlayer = player;
+            isPlaying = true;
+
+            // A failed stream falls back to the static audio; if that fails too, just unlock the button
+            const handleFailure = () => {
+                if (audioPlayer !== player) return;
+                if (url !== '/fallback-audio') {
+                    showStatus('Could not play the response audio.', 'error');
+                    playBotAudio('/fallback-audio');
+                } else {
+                    resetRecordButton();
+                }
+            };
+
+            player.onended = () => {
+                console.log('Bot response audio ended. Ready for new input.');
+                resetRecordButton();
+            };
+            player.onerror = handleFailure;
+            player.play().catch(handleFailure);
+        }
+
+        function resetRecordButton() {
+            isPlaying = false;
+            audioPlayer = null;
+            const recordBtn = document.getElementById('recordBtn');
+            recordBtn.disabled = false;
+            recordBtn.textContent = 'Start';
+            recordBtn.classList.remove('recording');
+            showStatus('Click "Start" to record your next message.', 'info');
+        }
         
+        async function runChatJob(formData) {
+            // Queue the turn, then follow its progress over SSE until it finishes
+            const response = await fetch(`/agent/chat/${sessionId}?mode=job`, {
+                method: 'POST',
+                body: formData
+            });
+
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+
+            const job = await response.json();
+            const stageMessages = {
+                transcribed: 'Got it! Thinking of a reply...',
+                generated: 'Reply ready, preparing audio...',
+                synthesized: 'Audio ready.',
+                stream_ready: 'Starting audio...'
+            };
+
+            return new Promise((resolve, reject) => {
+                const events = new EventSource(job.events_url);
+                events.onmessage = (message) => {
+                    const event = JSON.parse(message.data);
+                    if (event.stage === 'completed') {
+                        events.close();
+                        resolve(event.result);
+                    } else if (event.stage === 'failed') {
+                        events.close();
+                        resolve({ error: event.error });
+                    } else if (stageMessages[event.stage]) {
+                        showStatus(stageMessages[event.stage], 'info', true);
+                    }
+                };
+                events.onerror = () => {
+                    events.close();
+                    reject(new Error('Lost connection to job progress'));
+                };
+            });
+        }
+
         function appendMessage(sender, text) {
             const historyDiv = document.getElementById('conversation-history');
             const messageDiv = document.createElement('div');
@@ -406,17 +457,117 @@ def index():
     '''
     return render_template_string(html_template)
 
-@app.route('/agent/chat/<session_id>', methods=['POST'])
-def agent_chat(session_id: str):
+def _sweep_pending_streams():
+    """Drops streams whose TTL has passed."""
+    now = time.monotonic()
+    with pending_streams_lock:
+        for stream_id in [key for key, entry in pending_streams.items() if entry['expires_at'] <= now]:
+            del pending_streams[stream_id]
+
+def _register_stream(text, voice_id, audio_settings):
+    """Stores a response for the streaming TTS route and returns its URL."""
+    _sweep_pending_streams()
+    stream_id = str(uuid.uuid4())
+    with pending_streams_lock:
+        pending_streams[stream_id] = {
+            'text': text,
+            'voice_id': voice_id,
+            'audio_settings': audio_settings,
+            'expires_at': time.monotonic() + Config.TTS_STREAM_TTL_SECONDS,
+            'audio': None,
+            'relaying': False,
+            'done': threading.Event()
+        }
+    return f"/agent/stream/{stream_id}"
+
+def _run_chat_turn(session_id, chat_request, audio_data, report=None):
     """
-    Handles the main conversational flow.
+    Runs one conversational turn and returns the validated response.
     1. Transcribes audio using AssemblyAI.
     2. Uses Gemini with chat history to generate a response.
     3. Generates speech from the response using Murf AI.
+    'report' is called with each finished stage so queued jobs can publish progress.
+    In stream mode the last stage is 'stream_ready': synthesis only starts when the
+    browser fetches the stream URL, which lives in memory and is lost on restart.
+    """
+    report = report or (lambda stage, **data: None)
+    audio_settings = murf.resolve_audio_settings(
+        profile=chat_request.audio_profile,
+        bandwidth_kbps=chat_request.bandwidth_kbps,
+        audio_format=chat_request.audio_format,
+        sample_rate=chat_request.sample_rate
+    )
+
+    # Step 1: Transcribe audio
+    user_transcription = assembly_ai.transcribe_audio(audio_data)
+    if not user_transcription.strip():
+        raise ValueError('No speech detected in audio')
+
+    logger.info(f"User transcription for session {session_id}: '{user_transcription}'")
+    report('transcribed', transcription=user_transcription)
+
+    # Step 2: Call Gemini with the full chat history
+    if session_id not in chat_history:
+        chat_history[session_id] = []
+    
+    chat_history[session_id].append({'role': 'user', 'parts': [{'text': user_transcription}]})
+    
+    llm_response_text = gemini.generate_response(chat_history[session_id])
+    logger.info(f"LLM generated response for session {session_id}: '{llm_response_text}'")
+
+    chat_history[session_id].append({'role': 'model', 'parts': [{'text': llm_response_text}]})
+    report('generated', llm_response=llm_response_text)
+
+    # Step 3: Generate speech with Murf AI, either streamed on demand or as a finished file
+    if chat_request.stream:
+        audio_url = _register_stream(llm_response_text, chat_request.voice_id, audio_settings)
+    else:
+        murf_response = murf.generate_speech(
+            llm_response_text, voice_id=chat_request.voice_id, audio_settings=audio_settings
+        )
+        audio_url = murf_response['audioFile']
+    # A stream URL only promises audio on first fetch, and does not survive a restart
+    report('stream_ready' if chat_request.stream else 'synthesized', audio_url=audio_url)
+    
+    # Construct and validate the response using Pydantic
+    return ChatResponse(
+        success=True,
+        transcription=user_transcription,
+        llm_response=llm_response_text,
+        audio_url=audio_url,
+        audio_profile=audio_settings['profile']
+    )
+
+def _process_chat_job(payload, audio_data, report):
+    """Job queue handler: runs a queued turn and returns the response as a dict."""
+    chat_request = ChatRequest(**payload['chat_request'])
+    return _run_chat_turn(payload['session_id'], chat_request, audio_data, report).dict()
+
+job_queue = JobQueue(
+    _process_chat_job,
+    directory=Config.JOB_QUEUE_DIR,
+    workers=Config.JOB_WORKERS,
+    max_size=Config.JOB_QUEUE_MAX_SIZE,
+    retention_seconds=Config.JOB_RETENTION_SECONDS
+)
+
+@app.route('/agent/chat/<session_id>', methods=['POST'])
+def agent_chat(session_id: str):
+    """
+    Handles the main conversational flow.
+    With '?mode=job' the turn is queued and a job ID is returned right away;
+    otherwise the response is returned once the whole pipeline has finished.
     """
     try:
         # Pydantic validation for incoming request
-        chat_request = ChatRequest(voice_id=request.form.get('voice_id', 'natalie'))
+        chat_request = ChatRequest(
+            voice_id=request.form.get('voice_id', 'natalie'),
+            audio_profile=request.form.get('audio_profile') or None,
+            bandwidth_kbps=request.form.get('bandwidth_kbps') or None,
+            audio_format=request.form.get('audio_format') or None,
+            sample_rate=request.form.get('sample_rate') or None,
+            stream=request.form.get('stream', 'false')
+        )
         
         if 'audio' not in request.files:
             return jsonify({'error': 'No audio file provided'}), 400
@@ -430,38 +581,30 @@ def agent_chat(session_id: str):
 
         logger.info(f"Received audio file for session {session_id}: {audio_file.filename}")
         audio_data = audio_file.read()
-        
-        # Step 1: Transcribe audio
-        user_transcription = assembly_ai.transcribe_audio(audio_data)
-        if not user_transcription.strip():
-            return jsonify({'error': 'No speech detected in audio'}), 400
-
-        logger.info(f"User transcription for session {session_id}: '{user_transcription}'")
-
-        # Step 2: Call Gemini with the full chat history
-        if session_id not in chat_history:
-            chat_history[session_id] = []
-        
-        chat_history[session_id].append({'role': 'user', 'parts': [{'text': user_transcription}]})
-        
-        llm_response_text = gemini.generate_response(chat_history[session_id])
-        logger.info(f"LLM generated response for session {session_id}: '{llm_response_text}'")
 
-        chat_history[session_id].append({'role': 'model', 'parts': [{'text': llm_response_text}]})
+        # Reject bad audio settings up front instead of failing the job later
+        murf.resolve_audio_settings(
+            profile=chat_request.audio_profile,
+            bandwidth_kbps=chat_request.bandwidth_kbps,
+            audio_format=chat_request.audio_format,
+            sample_rate=chat_request.sample_rate
+        )
 
-        # Step 3: Generate speech with Murf AI
-        murf_response = murf.generate_speech(llm_response_text, voice_id=chat_request.voice_id)
-        audio_url = murf_response['audioFile']
+        if request.args.get('mode') == 'job':
+            job_queue.start()
+            job_id = job_queue.submit({'session_id': session_id, 'chat_request': chat_request.dict()}, audio_data)
+            return jsonify({
+                'job_id': job_id,
+                'status_url': f"/agent/jobs/{job_id}",
+                'events_url': f"/agent/jobs/{job_id}/events"
+            }), 202
         
-        # Construct and validate the response using Pydantic
-        response_data = ChatResponse(
-            success=True,
-            transcription=user_transcription,
-            llm_response=llm_response_text,
-            audio_url=audio_url
-        )
+        response_data = _run_chat_turn(session_id, chat_request, audio_data)
         return jsonify(response_data.dict())
 
+    except QueueFullError as e:
+        logger.warning(f"Rejected chat turn for session {session_id}: {e}")
+        return jsonify({'error': str(e)}), 503
     except (ValidationError, ValueError) as e:
         logger.error(f"Validation Error or Bad Request: {e}")
         return jsonify({'error': str(e)}), 400
@@ -469,6 +612,132 @@ def agent_chat(session_id: str):
         logger.error(f"General Error in agent chat endpoint for session {session_id}: {str(e)}", exc_info=True)
         return jsonify({'error': 'An unexpected error occurred. ' + str(e)}), 500
 
+@app.route('/agent/jobs/<job_id>', methods=['GET'])
+def get_job(job_id: str):
+    """
+    Returns a queued chat turn's status and progress events.
+    Pass '?after=<n>' to long-poll until more than n events exist or the job finishes.
+    """
+    job_queue.start()
+    after = request.args.get('after', type=int)
+    if after is None:
+        job = job_queue.get(job_id)
+    else:
+        job = job_queue.wait_for_events(job_id, after, Config.JOB_POLL_TIMEOUT)
+
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+@app.route('/agent/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id: str):
+    """Streams a queued chat turn's progress events over Server-Sent Events."""
+    job_queue.start()
+    if job_queue.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    def generate():
+        sent = 0
+        while True:
+            job = job_queue.wait_for_events(job_id, sent, Config.JOB_POLL_TIMEOUT)
+            if job is None:
+                # The job was pruned before its final event was delivered
+                expired = {'stage': 'failed', 'result': None, 'error': 'Job expired before its result was delivered.'}
+                yield f"data: {json.dumps(expired)}\n\n"
+                return
+            new_events = job['events'][sent:]
+            if not new_events:
+                # Comment line keeps idle proxies from closing the connection
+                yield ": keep-alive\n\n"
+            for event in new_events:
+                if event['stage'] in TERMINAL_STATUSES:
+                    event = {**event, 'result': job['result'], 'error': job['error']}
+                yield f"data: {json.dumps(event)}\n\n"
+            sent += len(new_events)
+            if job['status'] in TERMINAL_STATUSES and sent >= len(job['events']):
+                return
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/agent/stream/<stream_id>', methods=['GET'])
+def agent_stream(stream_id: str):
+    """
+    Relays synthesized speech to the browser as Murf produces it.
+    The first request relays and caches the audio; later requests, including Range requests,
+    are served from the cache once it is complete.
+    """
+    _sweep_pending_streams()
+    with pending_streams_lock:
+        pending = pending_streams.get(stream_id)
+        if pending is None:
+            return jsonify({'error': 'Unknown or expired audio stream'}), 404
+        relay = pending['audio'] is None and not pending['relaying']
+        if relay:
+            pending['relaying'] = True
+        done = pending['done']
+
+    mimetype = pending['audio_settings']['mimetype']
+    if not relay:
+        if pending['audio'] is None:
+            done.wait(Config.TTS_STREAM_WAIT_SECONDS)
+        audio = pending['audio']
+        if audio is not None:
+            response = Response(audio, mimetype=mimetype)
+            return response.make_conditional(request, accept_ranges=True, complete_length=len(audio))
+        # The other relay failed or is still running, so fetch our own copy without caching it
+
+    try:
+        chunks = murf.stream_speech(
+            pending['text'], voice_id=pending['voice_id'], audio_settings=pending['audio_settings']
+        )
+        # Pull the first chunk here so upstream failures surface as an error response
+        first_chunk = next(chunks, b'')
+    except Exception as e:
+        logger.error(f"Error starting audio stream {stream_id}: {str(e)}", exc_info=True)
+        if relay:
+            _end_relay(pending)
+        return jsonify({'error': 'Failed to stream audio. ' + str(e)}), 502
+
+    def generate():
+        received = [first_chunk]
+        completed = False
+        try:
+            yield first_chunk
+            for chunk in chunks:
+                received.append(chunk)
+                yield chunk
+            completed = True
+        finally:
+            if relay:
+                _end_relay(pending, b''.join(received) if completed else None)
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def _end_relay(pending, audio=None):
+    """Marks a relay as finished, caching its audio if it completed, and wakes waiting requests."""
+    with pending_streams_lock:
+        pending['audio'] = audio
+        pending['relaying'] = False
+        done, pending['done'] = pending['done'], threading.Event()
+    done.set()
+
+@app.route('/agent/key-stats', methods=['GET'])
+def key_stats():
+    """
+    Reports per-key usage, errors and latency for each provider's key pool.
+    Requires the X-Admin-Token header when KEY_STATS_TOKEN is set; otherwise only served in debug mode.
+    """
+    if Config.KEY_STATS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), Config.KEY_STATS_TOKEN):
+            return jsonify({'error': 'Forbidden'}), 403
+    elif not Config.DEBUG:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({pool.provider: pool.stats() for pool in (assembly_ai_keys, google_keys, murf_keys)})
+
 @app.route('/fallback-audio', methods=['GET'])
 def get_fallback_audio():
     """Serves the static fallback audio file."""
@@ -481,4 +750,7 @@ def get_fallback_audio():
 if __name__ == '__main__':
     # Generate fallback audio on startup if needed
     murf.generate_fallback_audio()
+    # Under the debug reloader only the child process should run workers and recover jobs
+    if not Config.DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_queue.start()
     app.run(debug=Config.DEBUG, host='0.0.0.0', port=Config.PORT)
\ No newline at end of file
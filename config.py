@@ -5,22 +5,67 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+def _load_keys(pool_var, single_var):
+    """
+    Reads a comma-separated key pool such as 'key1:3,key2' (':3' is an optional weight),
+    falling back to the single-key variable.
+    """
+    keys = []
+    for item in os.getenv(pool_var, os.getenv(single_var, "")).split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, _, weight = item.rpartition(':')
+        if key and weight.isdigit():
+            keys.append((key, int(weight)))
+        else:
+            keys.append((item, 1))
+    return keys
+
 class Config:
     """Application configuration settings."""
     DEBUG = os.getenv("FLASK_DEBUG", "True").lower() in ('true', '1', 't')
     PORT = int(os.getenv("PORT", 5000))
 
-    # API Keys
-    ASSEMBLY_AI_API_KEY = os.getenv("ASSEMBLY_AI_API_KEY")
-    MURF_API_KEY = os.getenv("MURF_API_KEY")
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+    # API key pools as (key, weight) pairs
+    ASSEMBLY_AI_API_KEYS = _load_keys("ASSEMBLY_AI_API_KEYS", "ASSEMBLY_AI_API_KEY")
+    MURF_API_KEYS = _load_keys("MURF_API_KEYS", "MURF_API_KEY")
+    GOOGLE_API_KEYS = _load_keys("GOOGLE_API_KEYS", "GOOGLE_API_KEY")
+    KEY_BENCH_SECONDS = int(os.getenv("KEY_BENCH_SECONDS", 60))
+    KEY_STATS_TOKEN = os.getenv("KEY_STATS_TOKEN")
 
     # Service URLs
     ASSEMBLY_AI_UPLOAD_URL = 'https://api.assemblyai.com/v2/upload'
     ASSEMBLY_AI_TRANSCRIPT_URL = 'https://api.assemblyai.com/v2/transcript'
     MURF_API_URL = 'https://api.murf.ai/v1/speech/generate'
     MURF_VOICES_URL = 'https://api.murf.ai/v1/speech/voices'
+    MURF_STREAM_URL = 'https://api.murf.ai/v1/speech/stream'
     GEMINI_MODEL = "gemini-2.0-flash"
 
+    # TTS output tiers, ordered from richest to leanest. 'min_kbps' is the
+    # measured client throughput needed before a tier is picked automatically.
+    TTS_PROFILES = {
+        'high': {'format': 'MP3', 'sample_rate': 44100, 'min_kbps': 1000},
+        'standard': {'format': 'MP3', 'sample_rate': 24000, 'min_kbps': 250},
+        'low': {'format': 'MP3', 'sample_rate': 8000, 'min_kbps': 0},
+    }
+    TTS_DEFAULT_PROFILE = os.getenv("TTS_DEFAULT_PROFILE", "standard")
+    if TTS_DEFAULT_PROFILE not in TTS_PROFILES:
+        raise ValueError(
+            f"TTS_DEFAULT_PROFILE must be one of {', '.join(TTS_PROFILES)}, got '{TTS_DEFAULT_PROFILE}'."
+        )
+    TTS_FORMATS = {'MP3': 'audio/mpeg', 'WAV': 'audio/wav', 'OGG': 'audio/ogg', 'FLAC': 'audio/flac'}
+    TTS_SAMPLE_RATES = {8000, 24000, 44100, 48000}
+    TTS_STREAM_CHUNK_SIZE = 4096
+    TTS_STREAM_TTL_SECONDS = int(os.getenv("TTS_STREAM_TTL_SECONDS", 300))
+    TTS_STREAM_WAIT_SECONDS = 30
+
+    # Background job queue for /agent/chat?mode=job
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+    JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", 100))
+    JOB_QUEUE_DIR = os.getenv("JOB_QUEUE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_jobs"))
+    JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 3600))
+    JOB_POLL_TIMEOUT = 25
+
     # Other settings
     ALLOWED_EXTENSIONS = {'wav', 'mp3', 'mp4', 'm4a', 'webm', 'ogg'}
\ No newline at end of file
@@ -0,0 +1,243 @@
+# job_queue.py
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job."""
+
+class JobQueue:
+    """
+    A bounded worker pool that runs chat turns in the background.
+    Each job is mirrored to a JSON file (plus its raw audio) in 'directory',
+    so unfinished jobs are picked up again after a restart.
+    Finished jobs are kept for 'retention_seconds' and then pruned.
+    """
+
+    def __init__(self, handler, directory, workers, max_size, retention_seconds):
+        self.handler = handler
+        self.directory = directory
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue(maxsize=max_size)
+        # Jobs recovered at startup bypass the size limit and run before newly submitted ones
+        self._backlog = collections.deque()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._started = False
+
+    def start(self):
+        """Loads persisted jobs and starts the worker threads."""
+        # Loading happens under the lock so requests made during recovery wait for it
+        with self._lock:
+            if self._started:
+                return
+
+            self._prepare_directory()
+            self._load_jobs()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"chat-worker-{index}", daemon=True)
+                thread.start()
+            self._started = True
+        logger.info(f"Job queue started with {self.workers} workers in {self.directory}")
+
+    def submit(self, payload, audio_data):
+        """Persists and enqueues a job, returning its ID."""
+        job_id = str(uuid.uuid4())
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'payload': payload,
+            'events': [{'stage': 'queued'}],
+            'result': None,
+            'error': None,
+            'created_at': time.time()
+        }
+        self._write_private(self._audio_path(job_id), audio_data)
+
+        with self._lock:
+            self._jobs[job_id] = job
+            self._save(job)
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            self._remove_files(job_id)
+            raise QueueFullError("Too many chat turns are queued. Please try again shortly.")
+
+        logger.info(f"Queued chat job {job_id}")
+        return job_id
+
+    def get(self, job_id):
+        """Returns a snapshot of the job, or None if it is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def wait_for_events(self, job_id, after, timeout):
+        """
+        Blocks until the job has more than 'after' events, finishes, or 'timeout' passes.
+        Returns a snapshot of the job, or None if it is unknown.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return None
+                remaining = deadline - time.monotonic()
+                if len(job['events']) > after or job['status'] in TERMINAL_STATUSES or remaining <= 0:
+                    return self._snapshot(job)
+                self._changed.wait(remaining)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                job_id = self._backlog.popleft() if self._backlog else None
+            if job_id is not None:
+                self._run(job_id)
+                continue
+
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            job['status'] = 'running'
+            payload = job['payload']
+            self._save(job)
+
+        try:
+            with open(self._audio_path(job_id), 'rb') as f:
+                audio_data = f.read()
+            result = self.handler(payload, audio_data, lambda stage, **data: self._report(job_id, stage, data))
+            self._finish(job_id, 'completed', result=result)
+        except Exception as e:
+            logger.error(f"Chat job {job_id} failed: {e}", exc_info=True)
+            self._finish(job_id, 'failed', error=str(e))
+
+    def _report(self, job_id, stage, data):
+        with self._changed:
+            job = self._jobs[job_id]
+            job['events'].append({'stage': stage, **data})
+            self._save(job)
+            self._changed.notify_all()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._changed:
+            self._mark_finished(self._jobs[job_id], status, result, error)
+            # Keep the job just finished so waiting clients still see its result
+            self._prune_expired(keep=job_id)
+            self._changed.notify_all()
+
+    def _mark_finished(self, job, status, result=None, error=None):
+        # Callers must hold self._lock
+        job['status'] = status
+        job['result'] = result
+        job['error'] = error
+        job['finished_at'] = time.time()
+        job['events'].append({'stage': status})
+        self._save(job)
+
+        audio_path = self._audio_path(job['id'])
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+
+    def _prune_expired(self, keep=None):
+        """Forgets finished jobs older than the retention period. Callers must hold self._lock."""
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job_id != keep and job['status'] in TERMINAL_STATUSES
+            and job.get('finished_at', job['created_at']) < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._remove_files(job_id)
+
+    def _load_jobs(self):
+        """Restores persisted jobs, re-enqueueing any that had not finished. Callers must hold self._lock."""
+        recovered = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-len('.json')]
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Skipping unreadable job file {name}: {e}")
+                continue
+
+            if job['status'] in TERMINAL_STATUSES:
+                self._jobs[job_id] = job
+                continue
+
+            if not os.path.exists(self._audio_path(job_id)):
+                logger.error(f"Dropping job {job_id}: its audio is missing.")
+                self._remove_files(job_id)
+                continue
+
+            # Interrupted jobs restart from the beginning of the pipeline
+            job['status'] = 'queued'
+            job['events'] = [{'stage': 'queued'}]
+            self._jobs[job_id] = job
+            self._save(job)
+            recovered.append(job)
+
+        for job in sorted(recovered, key=lambda job: job['created_at']):
+            self._backlog.append(job['id'])
+            logger.info(f"Recovered chat job {job['id']}")
+
+        self._prune_expired()
+
+    def _prepare_directory(self):
+        """Creates the job directory private to this user, refusing one owned by someone else."""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        if hasattr(os, 'getuid') and os.stat(self.directory).st_uid != os.getuid():
+            raise PermissionError(f"Job directory {self.directory} is not owned by the current user.")
+        os.chmod(self.directory, 0o700)
+
+    @staticmethod
+    def _write_private(path, data):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+    def _save(self, job):
+        # Write to a temporary file first so a crash never leaves a half-written job
+        path = self._job_path(job['id'])
+        self._write_private(path + '.tmp', json.dumps(job).encode('utf-8'))
+        os.replace(path + '.tmp', path)
+
+    def _remove_files(self, job_id):
+        for path in (self._job_path(job_id), self._audio_path(job_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _job_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _audio_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.audio")
+
+    @staticmethod
+    def _snapshot(job):
+        snapshot = {key: value for key, value in job.items() if key != 'payload'}
+        snapshot['events'] = list(job['events'])
+        return snapshot
@@ -4,6 +4,7 @@ import time
 import logging
 
 from config import Config
+from services.key_pool import assembly_ai_keys
 
 logger = logging.getLogger(__name__)
 
@@ -11,30 +12,21 @@ def is_allowed_file(filename):
     """Checks if the file extension is allowed."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
-def _upload_audio(audio_data):
+def _upload_audio(audio_data, api_key):
     """Uploads audio file to AssemblyAI and returns the upload URL."""
-    if not Config.ASSEMBLY_AI_API_KEY:
-        raise ValueError("AssemblyAI API key is not set.")
+    def send(key):
+        headers = {
+            'authorization': key,
+            'content-type': 'application/octet-stream'
+        }
+        return requests.post(Config.ASSEMBLY_AI_UPLOAD_URL, data=audio_data, headers=headers)
     
-    headers = {
-        'authorization': Config.ASSEMBLY_AI_API_KEY,
-        'content-type': 'application/octet-stream'
-    }
-    
-    response = requests.post(Config.ASSEMBLY_AI_UPLOAD_URL, data=audio_data, headers=headers)
+    response = assembly_ai_keys.call(send, key=api_key)
     response.raise_for_status()
     return response.json()['upload_url']
 
-def _request_transcription(audio_url):
+def _request_transcription(audio_url, api_key):
     """Requests transcription from AssemblyAI and returns the transcript ID."""
-    if not Config.ASSEMBLY_AI_API_KEY:
-        raise ValueError("AssemblyAI API key is not set.")
-
-    headers = {
-        'authorization': Config.ASSEMBLY_AI_API_KEY,
-        'content-type': 'application/json'
-    }
-    
     data = {
         'audio_url': audio_url,
         'language_detection': True,
@@ -42,21 +34,33 @@ def _request_transcription(audio_url):
         'format_text': True
     }
     
-    response = requests.post(Config.ASSEMBLY_AI_TRANSCRIPT_URL, json=data, headers=headers)
+    def send(key):
+        headers = {
+            'authorization': key,
+            'content-type': 'application/json'
+        }
+        return requests.post(Config.ASSEMBLY_AI_TRANSCRIPT_URL, json=data, headers=headers)
+    
+    response = assembly_ai_keys.call(send, key=api_key)
     response.raise_for_status()
     return response.json()['id']
 
-def _get_transcription_result(transcript_id):
+def _get_transcription_result(transcript_id, api_key):
     """Polls for transcription completion and returns the transcribed text."""
-    if not Config.ASSEMBLY_AI_API_KEY:
-        raise ValueError("AssemblyAI API key is not set.")
-    
-    headers = {'authorization': Config.ASSEMBLY_AI_API_KEY}
+    def send(key):
+        return requests.get(f"{Config.ASSEMBLY_AI_TRANSCRIPT_URL}/{transcript_id}", headers={'authorization': key})
+
     max_attempts = 30  # 5 minutes max (30 * 10s)
     attempt = 0
     
     while attempt < max_attempts:
-        response = requests.get(f"{Config.ASSEMBLY_AI_TRANSCRIPT_URL}/{transcript_id}", headers=headers)
+        response = assembly_ai_keys.call(send, key=api_key)
+        if response.status_code == 429:
+            # The transcript belongs to this key's account, so wait out the rate limit and keep polling
+            retry_after = response.headers.get('Retry-After', '')
+            time.sleep(int(retry_after) if retry_after.isdigit() else 10)
+            attempt += 1
+            continue
         response.raise_for_status()
         result = response.json()
         
@@ -74,12 +78,14 @@ def transcribe_audio(audio_data):
     """
     Main function to orchestrate the transcription process.
     Handles upload, transcription request, and polling for the result.
+    Uploads and transcripts belong to one account, so a single pooled key is used throughout.
     """
     try:
         logger.info("Starting AssemblyAI transcription process.")
-        audio_url = _upload_audio(audio_data)
-        transcript_id = _request_transcription(audio_url)
-        transcription = _get_transcription_result(transcript_id)
+        api_key = assembly_ai_keys.acquire()
+        audio_url = _upload_audio(audio_data, api_key)
+        transcript_id = _request_transcription(audio_url, api_key)
+        transcription = _get_transcription_result(transcript_id, api_key)
         logger.info("AssemblyAI transcription successful.")
         return transcription
     except Exception as e:
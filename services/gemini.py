@@ -3,6 +3,7 @@ import requests
 import logging
 
 from config import Config
+from services.key_pool import google_keys
 
 logger = logging.getLogger(__name__)
 
@@ -11,15 +12,14 @@ def generate_response(contents):
     Calls Google's Gemini API to generate a response.
     'contents' can be a single text string or a list of message objects for multi-turn conversations.
     """
-    if not Config.GOOGLE_API_KEY:
-        raise ValueError("Google API key is not configured.")
-
     url = f"https://generativelanguage.googleapis.com/v1beta/models/{Config.GEMINI_MODEL}:generateContent"
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'X-goog-api-key': Config.GOOGLE_API_KEY
-    }
+
+    def send(api_key):
+        headers = {
+            'Content-Type': 'application/json',
+            'X-goog-api-key': api_key
+        }
+        return requests.post(url, headers=headers, json=data)
     
     if isinstance(contents, str):
         data = {'contents': [{'parts': [{'text': contents}]}]}
@@ -30,7 +30,7 @@ def generate_response(contents):
     
     try:
         logger.info("Calling Gemini API...")
-        response = requests.post(url, headers=headers, json=data)
+        response = google_keys.call(send)
         response.raise_for_status()
         response_json = response.json()
         
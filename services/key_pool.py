@@ -0,0 +1,155 @@
+# services/key_pool.py
+import logging
+import threading
+import time
+
+import requests
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean a key is rate-limited or no longer valid
+BENCH_STATUS_CODES = {401, 403, 429}
+
+# Google reports a bad key as HTTP 400 with one of these reasons in the error details
+GOOGLE_KEY_ERROR_REASONS = {'API_KEY_INVALID', 'API_KEY_EXPIRED'}
+
+def should_bench(response):
+    """Default check: benches keys on rate-limit and auth status codes."""
+    return response.status_code in BENCH_STATUS_CODES
+
+def google_should_bench(response):
+    """Also benches Google keys rejected with a 400 that names the key as invalid or expired."""
+    if should_bench(response):
+        return True
+    if response.status_code != 400:
+        return False
+    try:
+        details = response.json().get('error', {}).get('details', [])
+    except ValueError:
+        return False
+    return any(isinstance(detail, dict) and detail.get('reason') in GOOGLE_KEY_ERROR_REASONS for detail in details)
+
+class KeyPool:
+    """
+    Hands out a provider's API keys using smooth weighted round-robin.
+    Keys that hit a rate limit or an auth error are benched for a while,
+    and per-key usage and latency are tracked for the stats endpoint.
+    'bench_check' decides from a response whether its key should be benched.
+    """
+
+    def __init__(self, provider, keys, bench_seconds, bench_check=should_bench):
+        self.provider = provider
+        self.bench_seconds = bench_seconds
+        self.bench_check = bench_check
+        self._lock = threading.Lock()
+        self._keys = [
+            {
+                'key': key,
+                'weight': weight,
+                'current_weight': 0,
+                'benched_until': 0,
+                'requests': 0,
+                'errors': 0,
+                'benched': 0,
+                'total_latency': 0.0
+            }
+            for key, weight in keys
+        ]
+
+    def acquire(self):
+        """Returns the next key to use, skipping benched keys."""
+        if not self._keys:
+            raise ValueError(f"{self.provider} API key is not set.")
+
+        now = time.monotonic()
+        with self._lock:
+            available = [entry for entry in self._keys if entry['benched_until'] <= now]
+            if not available:
+                raise ValueError(f"All {self.provider} API keys are rate-limited. Please try again shortly.")
+
+            total_weight = sum(entry['weight'] for entry in available)
+            for entry in available:
+                entry['current_weight'] += entry['weight']
+            chosen = max(available, key=lambda entry: entry['current_weight'])
+            chosen['current_weight'] -= total_weight
+            return chosen['key']
+
+    def call(self, send, key=None):
+        """
+        Calls 'send' with a key from the pool and records the outcome.
+        If the key gets benched, an unpinned call retries once with the next available key.
+        Pass 'key' to pin the call to a key, e.g. when a resource belongs to one account.
+        """
+        if key:
+            return self._send(send, key)[0]
+
+        response, benched = self._send(send, self.acquire())
+        if not benched:
+            return response
+        try:
+            retry_key = self.acquire()
+        except ValueError:
+            return response
+
+        response.close()
+        return self._send(send, retry_key)[0]
+
+    def _send(self, send, key):
+        start = time.monotonic()
+        try:
+            response = send(key)
+        except requests.exceptions.RequestException:
+            self._record(key, time.monotonic() - start, error=True)
+            raise
+
+        self._record(key, time.monotonic() - start, error=response.status_code >= 400)
+        benched = self.bench_check(response)
+        if benched:
+            self._bench(key, response)
+        return response, benched
+
+    def stats(self):
+        """Returns per-key counters with the keys masked."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'key': f"...{entry['key'][-4:]}",
+                    'weight': entry['weight'],
+                    'requests': entry['requests'],
+                    'errors': entry['errors'],
+                    'times_benched': entry['benched'],
+                    'benched_for': max(0, round(entry['benched_until'] - now)),
+                    'avg_latency_ms': round(1000 * entry['total_latency'] / entry['requests']) if entry['requests'] else None
+                }
+                for entry in self._keys
+            ]
+
+    def _record(self, key, latency, error):
+        with self._lock:
+            entry = self._find(key)
+            entry['requests'] += 1
+            entry['total_latency'] += latency
+            if error:
+                entry['errors'] += 1
+
+    def _bench(self, key, response):
+        # Honour the provider's Retry-After hint when it gives one in seconds
+        retry_after = response.headers.get('Retry-After', '')
+        seconds = int(retry_after) if retry_after.isdigit() else self.bench_seconds
+        with self._lock:
+            entry = self._find(key)
+            entry['benched_until'] = time.monotonic() + seconds
+            entry['benched'] += 1
+        logger.warning(
+            f"Benched {self.provider} key ...{key[-4:]} for {seconds}s after HTTP {response.status_code}"
+        )
+
+    def _find(self, key):
+        return next(entry for entry in self._keys if entry['key'] == key)
+
+assembly_ai_keys = KeyPool('AssemblyAI', Config.ASSEMBLY_AI_API_KEYS, Config.KEY_BENCH_SECONDS)
+google_keys = KeyPool('Google', Config.GOOGLE_API_KEYS, Config.KEY_BENCH_SECONDS, bench_check=google_should_bench)
+murf_keys = KeyPool('Murf', Config.MURF_API_KEYS, Config.KEY_BENCH_SECONDS)
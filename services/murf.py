@@ -5,34 +5,70 @@ import os
 import tempfile
 
 from config import Config
+from services.key_pool import murf_keys
 
 logger = logging.getLogger(__name__)
 
-def generate_speech(text, voice_id='natalie'):
-    """Generates speech using Murf AI and returns the response JSON."""
-    if not Config.MURF_API_KEY:
-        raise ValueError("Murf API key is not set.")
-    
-    headers = {
-        'api-key': Config.MURF_API_KEY,
+def resolve_audio_settings(profile=None, bandwidth_kbps=None, audio_format=None, sample_rate=None):
+    """
+    Picks the TTS output settings for a client.
+    An explicit profile wins, then measured bandwidth, then the default profile.
+    'audio_format' and 'sample_rate' override the chosen profile's values.
+    """
+    if profile:
+        if profile not in Config.TTS_PROFILES:
+            raise ValueError(f"Unknown audio profile '{profile}'.")
+    elif bandwidth_kbps is not None:
+        profile = next(
+            (name for name, tier in Config.TTS_PROFILES.items() if bandwidth_kbps >= tier['min_kbps']),
+            list(Config.TTS_PROFILES)[-1]
+        )
+    else:
+        profile = Config.TTS_DEFAULT_PROFILE
+
+    tier = Config.TTS_PROFILES[profile]
+    audio_format = (audio_format or tier['format']).upper()
+    sample_rate = sample_rate or tier['sample_rate']
+
+    if audio_format not in Config.TTS_FORMATS:
+        raise ValueError(f"Unsupported audio format '{audio_format}'.")
+    if sample_rate not in Config.TTS_SAMPLE_RATES:
+        raise ValueError(f"Unsupported sample rate '{sample_rate}'.")
+
+    return {
+        'profile': profile,
+        'format': audio_format,
+        'sample_rate': sample_rate,
+        'mimetype': Config.TTS_FORMATS[audio_format]
+    }
+
+def _build_headers(api_key, accept='application/json'):
+    return {
+        'api-key': api_key,
         'Content-Type': 'application/json',
-        'Accept': 'application/json'
+        'Accept': accept
     }
+
+def generate_speech(text, voice_id='natalie', audio_settings=None):
+    """Generates speech using Murf AI and returns the response JSON."""
+    audio_settings = audio_settings or resolve_audio_settings()
     
     data = {
         'text': text,
         'voiceId': voice_id,
-        'audioFormat': 'MP3',
+        'audioFormat': audio_settings['format'],
         'model': 'GEN2',
         'speed': 0,
         'pitch': 0,
         'channelType': 'MONO',
-        'sampleRate': 24000
+        'sampleRate': audio_settings['sample_rate']
     }
     
     try:
         logger.info(f"Generating speech with Murf AI for voice_id: {voice_id}")
-        response = requests.post(Config.MURF_API_URL, json=data, headers=headers)
+        response = murf_keys.call(
+            lambda api_key: requests.post(Config.MURF_API_URL, json=data, headers=_build_headers(api_key))
+        )
         response.raise_for_status()
         
         murf_response = response.json()
@@ -48,6 +84,40 @@ def generate_speech(text, voice_id='natalie'):
         logger.error(f"Murf speech generation failed: {e}", exc_info=True)
         raise ValueError("Failed to generate speech.") from e
 
+def stream_speech(text, voice_id='natalie', audio_settings=None):
+    """
+    Streams synthesized speech from Murf AI.
+    Yields audio bytes as they arrive so playback can start before synthesis finishes.
+    """
+    audio_settings = audio_settings or resolve_audio_settings()
+    accept = audio_settings['mimetype']
+
+    data = {
+        'text': text,
+        'voiceId': voice_id,
+        'format': audio_settings['format'],
+        'channelType': 'MONO',
+        'sampleRate': audio_settings['sample_rate']
+    }
+
+    logger.info(f"Streaming speech with Murf AI for voice_id: {voice_id}")
+    try:
+        response = murf_keys.call(
+            lambda api_key: requests.post(
+                Config.MURF_STREAM_URL, json=data, headers=_build_headers(api_key, accept=accept), stream=True
+            )
+        )
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as err:
+        logger.error(f"Murf stream HTTP Error: {err.response.status_code} - {err.response.text}", exc_info=True)
+        raise ValueError("Murf API request failed.") from err
+
+    with response:
+        for chunk in response.iter_content(chunk_size=Config.TTS_STREAM_CHUNK_SIZE):
+            if chunk:
+                yield chunk
+    logger.info("Murf AI speech stream finished.")
+
 def generate_fallback_audio():
     """Generates and saves a static fallback audio file if it doesn't exist."""
     text = "I'm having trouble connecting right now. Please try again later."